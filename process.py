@@ -5,16 +5,22 @@ GCS-only image thumbnail processor.
 This script:
 - Reads INPUT_FOLDER environment variable which must be a GCS path (gs://bucket[/prefix]).
 - Lists objects under that prefix and identifies images (by content-type if present, otherwise by extension).
-- Splits the total images across TASK_COUNT and TASK_INDEX (environment variables).
+- Splits the total images across TASK_COUNT and TASK_INDEX (environment variables), balancing
+  bytes plus a fixed per-image cost per task.
+- Processes the images assigned to this task concurrently on a thread pool.
 - For images assigned to this task, downloads each image, creates a 100x100 thumbnail (preserving aspect ratio),
   and uploads the thumbnail to the root of the same bucket in a timestamped folder:
-    gs://<bucket>/<TIMESTAMP>/<original_filename>
+    gs://<bucket>/<TIMESTAMP>/<original_name>.webp
+  (with THUMB_FORMAT=ORIGINAL the source format and filename are kept)
   The timestamp format includes year, month, day, hour (no seconds or minute): YYYYMMDDTHHZ
 
 Environment:
 - INPUT_FOLDER (required): gs://bucket[/optional/prefix]
 - CLOUD_RUN_TASK_INDEX (optional, default 0)
 - CLOUD_RUN_TASK_COUNT (optional, default 1)
+- MAX_WORKERS (optional, default min(32, 4 * container CPU limit)): worker threads per task
+- THUMB_FORMAT (optional, default WEBP): JPEG (or JPG), PNG, GIF, BMP, TIFF, WEBP, or ORIGINAL
+  to keep each source image's format
 
 Dependencies:
 - google-cloud-storage
@@ -24,26 +30,231 @@ Dependencies:
 from __future__ import annotations
 
 import datetime
+import hashlib
+import heapq
 import io
-import math
-import mimetypes
+import logging
+import logging.handlers
 import os
+import queue
+import signal
 import sys
-from typing import List, Tuple
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import IO, Dict, List, Tuple
 
 from google.cloud import storage
 from PIL import Image
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+def container_cpus() -> float:
+    """
+    Return the number of CPUs this process may use. A cgroup CPU limit (v2
+    cpu.max or v1 cfs quota/period) can be well below the host's core count on
+    Cloud Run, so it takes precedence over the scheduler affinity mask and
+    os.cpu_count().
+    """
+    try:
+        available = len(os.sched_getaffinity(0))
+    except AttributeError:
+        available = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return min(int(quota) / int(period), available)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota_us = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period_us = int(f.read())
+        if quota_us > 0 and period_us > 0:
+            return min(quota_us / period_us, available)
+    except (OSError, ValueError):
+        pass
+    return available
+
 
 # Configuration
 TASK_INDEX = int(os.environ.get("CLOUD_RUN_TASK_INDEX", "0"))
 TASK_COUNT = int(os.environ.get("CLOUD_RUN_TASK_COUNT", "1"))
 INPUT_FOLDER = os.environ.get("INPUT_FOLDER")
+# WebP encodes small thumbnails faster and smaller than JPEG/PNG and keeps alpha
+THUMB_FORMAT = os.environ.get("THUMB_FORMAT", "WEBP").upper()
+if THUMB_FORMAT == "JPG":
+    THUMB_FORMAT = "JPEG"
+_CPUS = container_cpus()
+# Work is mostly GCS I/O, so run several threads per CPU
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", str(min(32, max(1, int(4 * _CPUS))))))
 
 # Heuristic image file extensions
 _IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff", ".tif", ".webp"}
 
-# GCS client
+# Thumbnail bounding box. JPEG draft() and Image.reduce() first shrink the
+# source by integer factors to about _REDUCING_GAP times this size, so the
+# final LANCZOS pass only runs over a small image.
+_THUMB_SIZE = (100, 100)
+_REDUCING_GAP = 2.0
+
+# Fixed cost of one image in bytes-equivalent, for partitioning: every image
+# pays a download and an upload round-trip to GCS whatever its size, so
+# thousands of tiny files are not "free" next to one large original.
+_PER_IMAGE_COST = 256 * 1024
+
+# stdout is a pipe on Cloud Run, so it is block-buffered: flush log lines after
+# this many records, or after this many seconds, whichever comes first
+_LOG_FLUSH_RECORDS = 50
+_LOG_FLUSH_SECONDS = 2.0
+
+# Encoder settings for thumbnails, tuned for encode speed: at 100x100 the gains
+# from optimized/progressive JPEG or slower WebP methods are not visible.
+_SAVE_OPTIONS = {
+    "JPEG": {"quality": 78, "subsampling": 2, "optimize": False, "progressive": False},
+    "WEBP": {"quality": 75, "method": 0},
+}
+
+# Output format for each image extension (anything else is written as PNG)
+_EXT_TO_FORMAT = {
+    ".jpg": "JPEG",
+    ".jpeg": "JPEG",
+    ".png": "PNG",
+    ".gif": "GIF",
+    ".bmp": "BMP",
+    ".tiff": "TIFF",
+    ".tif": "TIFF",
+    ".webp": "WEBP",
+}
+
+# Extension used when a thumbnail's format differs from its source filename
+_FORMAT_TO_EXT = {
+    "JPEG": ".jpg",
+    "PNG": ".png",
+    "GIF": ".gif",
+    "BMP": ".bmp",
+    "TIFF": ".tif",
+    "WEBP": ".webp",
+}
+
+# Content type for each output format (avoids loading the system mime.types DB)
+_FORMAT_TO_MIME = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "GIF": "image/gif",
+    "BMP": "image/bmp",
+    "TIFF": "image/tiff",
+    "WEBP": "image/webp",
+}
+
+# GCS client, shared by every worker thread. Size its connection pool to the
+# thread count so each worker keeps a keep-alive connection instead of
+# opening (and then discarding) a new one whenever the pool is full.
 _storage_client = storage.Client()
+_storage_client._http.mount("https://", HTTPAdapter(pool_maxsize=max(MAX_WORKERS, 10)))
+
+# Decode/resize/encode is CPU-bound: allow one thumbnail per CPU at a time so
+# the remaining workers keep downloading and uploading rather than contending
+# for cores, and decoded rasters in memory stay bounded by the CPU count.
+_thumbnail_slots = threading.BoundedSemaphore(max(1, int(_CPUS)))
+
+
+class _BufferedStreamHandler(logging.StreamHandler):
+    """
+    StreamHandler that flushes every _LOG_FLUSH_RECORDS records, or once
+    _LOG_FLUSH_SECONDS have passed since the last flush, instead of after
+    every record.
+    """
+
+    def __init__(self, stream: IO[str]) -> None:
+        super().__init__(stream)
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+            self._unflushed += 1
+            if (
+                self._unflushed >= _LOG_FLUSH_RECORDS
+                or time.monotonic() - self._last_flush >= _LOG_FLUSH_SECONDS
+            ):
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self) -> None:
+        super().flush()
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+
+
+class _LogListener(logging.handlers.QueueListener):
+    """
+    QueueListener that also flushes its handlers whenever the queue has been
+    idle for _LOG_FLUSH_SECONDS, and before each WARNING or above so stderr
+    lines do not overtake earlier stdout lines.
+    """
+
+    def dequeue(self, block: bool) -> logging.LogRecord:
+        while True:
+            try:
+                return self.queue.get(block, timeout=_LOG_FLUSH_SECONDS)
+            except queue.Empty:
+                if not block:
+                    raise
+                self.flush()
+
+    def handle(self, record: logging.LogRecord) -> None:
+        if record.levelno >= logging.WARNING:
+            self.flush()
+        super().handle(record)
+
+    def flush(self) -> None:
+        for handler in self.handlers:
+            handler.flush()
+
+    def stop(self) -> None:
+        # Reached from both the SIGTERM handler and the exit path
+        if self._thread is not None:
+            super().stop()
+
+
+def start_logging() -> _LogListener:
+    """
+    Send this module's log records through a queue to a background thread that
+    writes INFO to stdout and WARNING and above to stderr, so neither the main
+    loop nor the workers block on console I/O. Pass the returned listener to
+    stop_logging() before exiting to write out pending records.
+    """
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    # One line per image: batch stdout flushes rather than flush each line
+    stdout_handler = _BufferedStreamHandler(sys.stdout)
+    stdout_handler.addFilter(lambda record: record.levelno < logging.WARNING)
+    stderr_handler = logging.StreamHandler(sys.stderr)
+    stderr_handler.setLevel(logging.WARNING)
+    listener = _LogListener(
+        records, stdout_handler, stderr_handler, respect_handler_level=True
+    )
+    listener.start()
+    return listener
+
+
+def stop_logging(listener: _LogListener) -> None:
+    """
+    Write out the records still queued for listener and flush its streams.
+    """
+    listener.stop()
+    listener.flush()
 
 
 def is_gs_path(path: str) -> bool:
@@ -66,19 +277,59 @@ def parse_gs_path(gs_path: str) -> Tuple[str, str]:
     return bucket, prefix
 
 
-def list_gs_objects(bucket_name: str, prefix: str | None) -> List[Tuple[str, str]]:
+def list_gs_level(
+    bucket_name: str, prefix: str | None, delimiter: str | None = "/"
+) -> Tuple[List[Tuple[str, str, int]], List[str]]:
     """
-    Return list of (blob_name, content_type) under the given prefix.
-    If prefix is None or empty, list the whole bucket.
+    List objects under prefix: return ((blob_name, content_type, size) tuples,
+    sub-prefixes ending in delimiter). With the default '/' delimiter this is
+    one "directory" level; with delimiter=None everything below prefix is
+    listed and there are no sub-prefixes.
     """
-    list_prefix = prefix if prefix else None
-    blobs = _storage_client.list_blobs(bucket_name, prefix=list_prefix)
-    results: List[Tuple[str, str]] = []
+    # Ask only for the fields we read; full object metadata is ~1 KB per item.
+    # prefixes must be kept for the delimiter listing, nextPageToken for paging.
+    blobs = _storage_client.list_blobs(
+        bucket_name,
+        prefix=prefix,
+        delimiter=delimiter,
+        fields="items(name,contentType,size),prefixes,nextPageToken",
+    )
+    results: List[Tuple[str, str, int]] = []
     for b in blobs:
         # skip directory placeholders
         if b.name.endswith("/"):
             continue
-        results.append((b.name, b.content_type or ""))
+        results.append((b.name, b.content_type or "", b.size or 0))
+    # prefixes is only complete once every page has been consumed
+    return results, sorted(blobs.prefixes)
+
+
+def list_gs_objects(bucket_name: str, prefix: str | None) -> List[Tuple[str, str, int]]:
+    """
+    Return list of (blob_name, content_type, size) under the given prefix.
+    If prefix is None or empty, list the whole bucket.
+
+    The top level is listed once with a '/' delimiter; each first-level
+    sub-prefix is then listed flat (no delimiter), concurrently, so one large
+    subtree is not paginated behind the others. Each object is listed once.
+    """
+    results, sub_prefixes = list_gs_level(bucket_name, prefix or None)
+    # INPUT_FOLDER is listed without its trailing '/', so its own folder comes
+    # back as the only sub-prefix; fan out over that folder's children instead
+    folder = f"{prefix}/" if prefix else None
+    if folder in sub_prefixes:
+        sub_prefixes.remove(folder)
+        objects, folder_prefixes = list_gs_level(bucket_name, folder)
+        results.extend(objects)
+        sub_prefixes.extend(folder_prefixes)
+    if sub_prefixes:
+        workers = min(MAX_WORKERS, len(sub_prefixes))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for objects, _ in executor.map(
+                lambda sub_prefix: list_gs_level(bucket_name, sub_prefix, None),
+                sub_prefixes,
+            ):
+                results.extend(objects)
     results.sort()
     return results
 
@@ -95,124 +346,264 @@ def looks_like_image(filename: str, content_type: str | None = None) -> bool:
     return ext in _IMAGE_EXTS
 
 
+def partition_by_size(
+    images: List[Tuple[str, str, int]], task_count: int, task_index: int
+) -> List[Tuple[str, str, int]]:
+    """
+    Split (blob_name, filename, size) images across task_count tasks by greedy
+    largest-first (LPT) bin packing on object size plus _PER_IMAGE_COST, and
+    return task_index's share, largest first. Every task computes the same
+    split from the same listing, so no coordination is needed.
+    """
+    # Heap of (assigned cost, task)
+    loads = [(0, task) for task in range(task_count)]
+    assigned: List[Tuple[str, str, int]] = []
+    for image in sorted(images, key=lambda i: (-i[2], i[0])):
+        load, task = heapq.heappop(loads)
+        if task == task_index:
+            assigned.append(image)
+        heapq.heappush(loads, (load + image[2] + _PER_IMAGE_COST, task))
+    return assigned
+
+
 def infer_format_from_ext(filename: str) -> str:
-    ext = os.path.splitext(filename)[1].lower()
-    mapping = {
-        ".jpg": "JPEG",
-        ".jpeg": "JPEG",
-        ".png": "PNG",
-        ".gif": "GIF",
-        ".bmp": "BMP",
-        ".tiff": "TIFF",
-        ".tif": "TIFF",
-        ".webp": "WEBP",
-    }
-    return mapping.get(ext, "PNG")
+    return _EXT_TO_FORMAT.get(os.path.splitext(filename)[1].lower(), "PNG")
+
+
+def output_format(filename: str) -> str:
+    """
+    Return the format the thumbnail of filename is written in: THUMB_FORMAT,
+    or the source format when THUMB_FORMAT is ORIGINAL.
+    """
+    if THUMB_FORMAT == "ORIGINAL":
+        return infer_format_from_ext(filename)
+    return THUMB_FORMAT
+
+
+def thumbnail_filename(filename: str, out_format: str) -> str:
+    """
+    Return the destination filename for a thumbnail written in out_format:
+    filename itself when its extension already maps to out_format, otherwise
+    the same stem with that format's extension (photo.jpg -> photo.webp).
+    """
+    if infer_format_from_ext(filename) == out_format:
+        return filename
+    return os.path.splitext(filename)[0] + _FORMAT_TO_EXT[out_format]
+
+
+def thumbnail_names(images: List[Tuple[str, str, int]]) -> Dict[str, str]:
+    """
+    Map each (blob_name, filename, size) image to the filename of its thumbnail.
+    Every task computes this from the same listing, so names do not depend on
+    how images are split across tasks or threads. Names that would collide keep
+    the source extension (a.jpg, a.png -> a.jpg.webp, a.png.webp); identical
+    filenames from different folders also get a short hash of the object name,
+    lengthened while it still clashes with another name.
+    """
+    names = {}
+    for blob_name, filename, _ in images:
+        names[blob_name] = thumbnail_filename(filename, output_format(filename))
+
+    counts = Counter(names.values())
+    for blob_name, filename, _ in images:
+        out_format = output_format(filename)
+        if (
+            counts[names[blob_name]] > 1
+            and infer_format_from_ext(filename) != out_format
+        ):
+            names[blob_name] = filename + _FORMAT_TO_EXT[out_format]
+
+    counts = Counter(names.values())
+    clashing = [blob_name for blob_name, _, _ in images if counts[names[blob_name]] > 1]
+    stems = {blob_name: os.path.splitext(names[blob_name]) for blob_name in clashing}
+    digest_len = 8
+    while clashing and digest_len <= 40:
+        for blob_name in clashing:
+            stem, ext = stems[blob_name]
+            digest = hashlib.sha1(blob_name.encode("utf-8")).hexdigest()
+            names[blob_name] = f"{stem}-{digest[:digest_len]}{ext}"
+        counts = Counter(names.values())
+        clashing = [blob_name for blob_name in clashing if counts[names[blob_name]] > 1]
+        digest_len += 4
+    return names
+
+
+def encode_thumbnail(img: Image.Image, out_format: str) -> bytes:
+    """
+    Encode an already-resized thumbnail in out_format and return the bytes.
+    """
+    buf = io.BytesIO()
+    fmt = out_format.upper()
+    # If saving JPEG and image has alpha, composite on white
+    if fmt == "JPEG" and img.mode in ("RGBA", "LA"):
+        bg = Image.new("RGB", img.size, (255, 255, 255))
+        # getchannel copies only the alpha band; split() would copy all four
+        bg.paste(img, mask=img.getchannel("A"))
+        bg.save(buf, format="JPEG", **_SAVE_OPTIONS["JPEG"])
+    else:
+        # Ensure a safe mode for formats that don't accept alpha
+        if fmt not in ("PNG", "WEBP", "GIF") and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(buf, format=fmt, **_SAVE_OPTIONS.get(fmt, {}))
+    return buf.getvalue()
 
 
-def create_thumbnail_bytes(image_bytes: bytes, out_format: str) -> bytes:
+def decode_thumbnail(src: IO[bytes]) -> Image.Image:
     """
-    Create a thumbnail (max 100x100, preserving aspect) from image_bytes and
-    return encoded bytes in out_format.
+    Decode the image in the binary file object src and return it resized to fit
+    within 100x100 (preserving aspect), fully loaded so it no longer reads src.
     """
-    with Image.open(io.BytesIO(image_bytes)) as img:
+    with Image.open(src) as img:
+        # Let libjpeg(-turbo) scale JPEGs down in the DCT domain (1/2, 1/4 or 1/8)
+        # before any mode conversion forces a full-resolution decode. Camera
+        # JPEGs carrying extra frames open as MPO and take the same path.
+        if img.format in ("JPEG", "MPO"):
+            img.draft(
+                None,
+                (
+                    int(_THUMB_SIZE[0] * _REDUCING_GAP),
+                    int(_THUMB_SIZE[1] * _REDUCING_GAP),
+                ),
+            )
+
         # Normalize modes
         if img.mode in ("P", "LA"):
             img = img.convert("RGBA")
         elif img.mode == "CMYK":
             img = img.convert("RGB")
 
-        img.thumbnail((100, 100), Image.LANCZOS)
-
-        buf = io.BytesIO()
-        fmt = out_format.upper()
-        # If saving JPEG and image has alpha, composite on white
-        if fmt in ("JPEG", "JPG") and img.mode in ("RGBA", "LA"):
-            bg = Image.new("RGB", img.size, (255, 255, 255))
-            alpha = img.split()[-1]
-            bg.paste(img, mask=alpha)
-            bg.save(buf, format="JPEG")
-        else:
-            # Ensure a safe mode for formats that don't accept alpha
-            if fmt not in ("PNG", "WEBP", "GIF") and img.mode not in ("RGB", "L"):
-                img = img.convert("RGB")
-            img.save(buf, format=fmt)
-        return buf.getvalue()
+        img.thumbnail(_THUMB_SIZE, Image.LANCZOS, reducing_gap=_REDUCING_GAP)
+        # Leaving the block closes the opened image, which may still be img;
+        # return a (thumbnail-sized) copy that owns its pixels. copy() also
+        # loads images thumbnail() left untouched because they fit the box.
+        return img.copy()
 
 
 def upload_bytes_to_gs(
-    bucket_name: str, dest_blob_name: str, data: bytes, content_type: str | None = None
+    bucket: storage.Bucket,
+    dest_blob_name: str,
+    data: bytes,
+    content_type: str | None = None,
 ) -> None:
-    bucket = _storage_client.bucket(bucket_name)
     blob = bucket.blob(dest_blob_name)
     blob.upload_from_string(data, content_type=content_type)
 
 
+def process_image(
+    bucket: storage.Bucket,
+    blob_name: str,
+    filename: str,
+    thumb_name: str,
+    timestamp: str,
+) -> str:
+    """
+    Download one source image, create its thumbnail and upload it to
+    <timestamp>/<thumb_name> in the same bucket. Return the destination blob name.
+    """
+    src_blob = bucket.blob(blob_name)
+    # Stream the object straight into the buffer Pillow reads from, rather
+    # than materializing a bytes copy first. Thumbnail sources are small enough
+    # that a single GET beats the chunked, resumable download path.
+    src = io.BytesIO()
+    src_blob.download_to_file(src, checksum=None, single_shot_download=True)
+
+    # Thumbnail in THUMB_FORMAT or the source format, falling back to PNG
+    out_format = output_format(filename)
+    with _thumbnail_slots:
+        src.seek(0)
+        img = decode_thumbnail(src)
+        try:
+            thumb_bytes = encode_thumbnail(img, out_format)
+        except (OSError, ValueError, KeyError):
+            # The encoder rejected this image in out_format; re-encode the
+            # already-decoded thumbnail as PNG rather than decoding again
+            out_format = "PNG"
+            thumb_bytes = encode_thumbnail(img, out_format)
+    # Release the source and decoded images before the upload; with several
+    # workers in flight these buffers dominate peak memory.
+    img.close()
+    src.close()
+
+    # Destination: root of bucket under timestamp folder. The name was fixed
+    # from the listing, so a PNG fallback keeps it and only the content type
+    # reflects the format actually written.
+    dest_blob_name = f"{timestamp}/{thumb_name}"
+
+    content_type = _FORMAT_TO_MIME.get(out_format, f"image/{out_format.lower()}")
+    upload_bytes_to_gs(bucket, dest_blob_name, thumb_bytes, content_type=content_type)
+    return dest_blob_name
+
+
 def process() -> None:
     # Validate INPUT_FOLDER
     if not INPUT_FOLDER:
-        print(
-            "ERROR: INPUT_FOLDER environment variable is required and must be a gs:// path.",
-            file=sys.stderr,
+        logger.error(
+            "ERROR: INPUT_FOLDER environment variable is required and must be a gs:// path."
         )
         sys.exit(2)
     if not is_gs_path(INPUT_FOLDER):
-        print(
-            "ERROR: INPUT_FOLDER must be a gs:// path. Local directories are not supported.",
-            file=sys.stderr,
+        logger.error(
+            "ERROR: INPUT_FOLDER must be a gs:// path. Local directories are not supported."
         )
         sys.exit(2)
 
     # Validate task configuration
     if TASK_COUNT <= 0:
-        print("ERROR: CLOUD_RUN_TASK_COUNT must be >= 1", file=sys.stderr)
+        logger.error("ERROR: CLOUD_RUN_TASK_COUNT must be >= 1")
         sys.exit(2)
     if TASK_INDEX < 0 or TASK_INDEX >= TASK_COUNT:
-        print(
-            f"ERROR: CLOUD_RUN_TASK_INDEX {TASK_INDEX} out of range for TASK_COUNT {TASK_COUNT}",
-            file=sys.stderr,
+        logger.error(
+            f"ERROR: CLOUD_RUN_TASK_INDEX {TASK_INDEX} out of range for TASK_COUNT {TASK_COUNT}"
+        )
+        sys.exit(2)
+    if MAX_WORKERS <= 0:
+        logger.error("ERROR: MAX_WORKERS must be >= 1")
+        sys.exit(2)
+    if THUMB_FORMAT != "ORIGINAL" and THUMB_FORMAT not in _FORMAT_TO_EXT:
+        logger.error(
+            f"ERROR: THUMB_FORMAT must be ORIGINAL or one of {', '.join(_FORMAT_TO_EXT)}"
         )
         sys.exit(2)
 
-    print(
-        f"Task {TASK_INDEX + 1}/{TASK_COUNT}: Starting. INPUT_FOLDER={INPUT_FOLDER}",
-        flush=True,
+    logger.info(
+        f"Task {TASK_INDEX + 1}/{TASK_COUNT}: Starting. INPUT_FOLDER={INPUT_FOLDER}"
     )
 
     bucket_name, prefix = parse_gs_path(INPUT_FOLDER)
     normalized_prefix = prefix.rstrip("/") if prefix else ""
-    print(f"Listing objects in gs://{bucket_name}/{normalized_prefix}", flush=True)
+    logger.info(f"Listing objects in gs://{bucket_name}/{normalized_prefix}")
 
     objects = list_gs_objects(bucket_name, normalized_prefix)
-    images: List[Tuple[str, str]] = []
-    for blob_name, content_type in objects:
-        fname = os.path.basename(blob_name)
+    images: List[Tuple[str, str, int]] = []
+    for blob_name, content_type, size in objects:
+        fname = blob_name[blob_name.rfind("/") + 1 :]
         if looks_like_image(fname, content_type):
-            images.append((blob_name, fname))
+            images.append((blob_name, fname, size))
 
     total = len(images)
     if total == 0:
-        print(
-            f"Task {TASK_INDEX}: No images found under {INPUT_FOLDER}. Nothing to do.",
-            flush=True,
+        logger.info(
+            f"Task {TASK_INDEX}: No images found under {INPUT_FOLDER}. Nothing to do."
         )
         return
 
-    # Determine chunking across TASK_COUNT
-    chunk_size = math.ceil(total / TASK_COUNT)
-    chunk_start = chunk_size * TASK_INDEX
-    chunk_end = min(chunk_start + chunk_size, total)
-    if chunk_start >= total:
-        print(
-            f"Task {TASK_INDEX}: No indices assigned (chunk_start={chunk_start} >= total={total}). Nothing to do.",
-            flush=True,
+    # Name every thumbnail from the full listing; two sources must never share a
+    # destination, or one upload would silently replace the other
+    thumb_names = thumbnail_names(images)
+    name_counts = Counter(thumb_names.values())
+
+    # Balance bytes plus a fixed per-image round-trip cost per task; object
+    # size comes free with the listing. The share comes back largest first, so big images start early and
+    # do not leave the other workers idle at the end of the run.
+    assigned = partition_by_size(images, TASK_COUNT, TASK_INDEX)
+    if not assigned:
+        logger.info(
+            f"Task {TASK_INDEX}: No images assigned ({total} images across {TASK_COUNT} tasks). Nothing to do."
         )
         return
 
-    assigned = images[chunk_start:chunk_end]
-    print(
-        f"Task {TASK_INDEX}: Found {total} images. Assigned indices [{chunk_start}, {chunk_end}) => {len(assigned)} images for this task.",
-        flush=True,
+    logger.info(
+        f"Task {TASK_INDEX}: Found {total} images. Assigned {len(assigned)} images ({sum(size for _, _, size in assigned)} bytes) to this task."
     )
 
     # Timestamp for output folder at root of bucket, include minutes but no seconds
@@ -220,51 +611,60 @@ def process() -> None:
     processed = 0
     errors = 0
 
-    for blob_name, filename in assigned:
-        try:
-            bucket = _storage_client.bucket(bucket_name)
-            src_blob = bucket.blob(blob_name)
-            image_bytes = src_blob.download_as_bytes()
-
-            # Try to create thumbnail in inferred format; fall back to PNG
-            out_format = infer_format_from_ext(filename)
-            try:
-                thumb_bytes = create_thumbnail_bytes(image_bytes, out_format)
-            except Exception:
-                # Validate it's an image and retry as PNG
-                with Image.open(io.BytesIO(image_bytes)):
-                    pass
-                out_format = "PNG"
-                thumb_bytes = create_thumbnail_bytes(image_bytes, out_format)
-
-            # Destination: root of bucket under timestamp folder
-            dest_blob_name = f"{timestamp}/{filename}"
-
-            content_type = (
-                mimetypes.guess_type(filename)[0] or f"image/{out_format.lower()}"
-            )
-            upload_bytes_to_gs(
-                bucket_name, dest_blob_name, thumb_bytes, content_type=content_type
+    # One bucket handle shared by all workers
+    bucket = _storage_client.bucket(bucket_name)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {}
+        for blob_name, filename, _ in assigned:
+            thumb_name = thumb_names[blob_name]
+            if name_counts[thumb_name] > 1:
+                # Skip rather than overwrite another source's thumbnail
+                errors += 1
+                logger.error(
+                    f"Task {TASK_INDEX}: Skipping gs://{bucket_name}/{blob_name}: thumbnail name {thumb_name} is not unique"
+                )
+                continue
+            future = executor.submit(
+                process_image,
+                bucket,
+                blob_name,
+                filename,
+                thumb_name,
+                timestamp,
             )
-
-            print(
-                f"Task {TASK_INDEX}: Processed {filename} -> gs://{bucket_name}/{dest_blob_name}",
-                flush=True,
+            futures[future] = (blob_name, filename)
+        for future in as_completed(futures):
+            blob_name, filename = futures[future]
+            try:
+                dest_blob_name = future.result()
+            except Exception as exc:
+                errors += 1
+                logger.error(
+                    f"Task {TASK_INDEX}: Error processing gs://{bucket_name}/{blob_name}: {exc}"
+                )
+                continue
+            logger.info(
+                f"Task {TASK_INDEX}: Processed {filename} -> gs://{bucket_name}/{dest_blob_name}"
             )
             processed += 1
-        except Exception as exc:
-            errors += 1
-            print(
-                f"Task {TASK_INDEX}: Error processing gs://{bucket_name}/{blob_name}: {exc}",
-                file=sys.stderr,
-                flush=True,
-            )
 
-    print(
-        f"Task {TASK_INDEX}: Completed. Processed {processed} image(s), {errors} error(s). Assigned indices [{chunk_start}, {chunk_end}) of {total}.",
-        flush=True,
+    logger.info(
+        f"Task {TASK_INDEX}: Completed. Processed {processed} image(s), {errors} error(s). Assigned {len(assigned)} of {total} images."
     )
 
 
 if __name__ == "__main__":
-    process()
+    log_listener = start_logging()
+
+    def handle_sigterm(signum: int, frame: object) -> None:
+        # Cloud Run sends SIGTERM before killing a task (e.g. at its timeout);
+        # write out the pending log lines while there is still time
+        stop_logging(log_listener)
+        sys.exit(128 + signum)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    try:
+        process()
+    finally:
+        # Drain queued log lines, including on sys.exit() from validation
+        stop_logging(log_listener)